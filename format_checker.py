@@ -32,7 +32,9 @@ Exit codes:
 from __future__ import print_function
 import sys
 import re
-from collections import namedtuple
+from collections import Counter, namedtuple
+from itertools import accumulate, chain, repeat
+from operator import add, mul, ne
 
 MetroSpec = namedtuple(
     'MetroSpec', ['scenario', 'N', 'M', 'K', 'J', 'P', 'starts', 'ends', 'popular'])
@@ -83,6 +85,10 @@ def parse_city(path):
         raise ValueError("Invalid numeric values in header")
     starts = []
     ends = []
+    # uniqueness of starts/ends is tracked inline with one dict:
+    # cell -> bitmask (1 = some start, 2 = some end)
+    roles = {}
+    dup_start = dup_end = start_is_end = False
     for lineno in range(K):
         while i < len(raw) and raw[i].strip() == '':
             i += 1
@@ -100,6 +106,14 @@ def parse_city(path):
                              (lineno, (sx, sy, ex, ey)))
         starts.append((sx, sy))
         ends.append((ex, ey))
+        mask = roles.get((sx, sy), 0)
+        dup_start |= bool(mask & 1)
+        start_is_end |= bool(mask & 2)
+        roles[(sx, sy)] = mask | 1
+        mask = roles.get((ex, ey), 0)
+        dup_end |= bool(mask & 2)
+        start_is_end |= bool(mask & 1)
+        roles[(ex, ey)] = mask | 2
     popular = []
     if scenario == 2:
         while i < len(raw) and raw[i].strip() == '':
@@ -119,55 +133,126 @@ def parse_city(path):
                 raise ValueError(
                     "Popular cell %d out of bounds: (%d,%d)" % (pidx, x, y))
             popular.append((x, y))
-    if len(set(starts)) != len(starts):
+    if dup_start:
         raise ValueError("Duplicate start locations in city file")
-    if len(set(ends)) != len(ends):
+    if dup_end:
         raise ValueError("Duplicate end locations in city file")
-    if set(starts).intersection(set(ends)):
+    if start_is_end:
         raise ValueError(
             "Some start equals some end location (all starts & ends must be unique)")
     return MetroSpec(scenario=scenario, N=N, M=M, K=K, J=J, P=P, starts=starts, ends=ends, popular=popular)
 
 
+UPPER_MOVES = str.maketrans('lrud', 'LRUD')
+# one line of moves in either form: compact "RRD0" or spaced "R R D 0"
+MOVES_LINE = re.compile(r'([LRUD]*)0|((?:[LRUD]\s+)*)0')
+
+
+def parse_moves_line(line, idx):
+    """Token-by-token parse of one metromap line; also produces the errors."""
+    tokens = line.strip().split()
+    if len(tokens) == 1 and re.fullmatch(r'[LRUDlrud0]+', tokens[0]):
+        s = tokens[0]
+        if s[-1] != '0':
+            raise ValueError(
+                "Line %d: expected trailing '0' token" % (idx+1))
+        return s[:-1].upper().encode('ascii')
+    if not tokens:
+        raise ValueError("Line %d is empty" % (idx+1))
+    if tokens[-1] != '0':
+        raise ValueError(
+            "Line %d: expected trailing '0' token" % (idx+1))
+    seq = tokens[:-1]
+    parsed = []
+    for t in seq:
+        if len(t) != 1 or t.upper() not in ('L', 'R', 'U', 'D'):
+            raise ValueError(
+                "Invalid token %r on line %d" % (t, idx+1))
+        parsed.append(t.upper())
+    return ''.join(parsed).encode('ascii')
+
+
 def parse_metromap(path):
+    """Return ('UNSAT', []) or ('SAT', metros), one bytes object of moves
+    per metro (e.g. b'RRD'), which costs one byte per move."""
     try:
         with open(path, 'r') as f:
-            raw = [ln.rstrip('\n') for ln in f.readlines()]
+            data = f.read()
     except Exception as e:
         raise ValueError("Failed reading metromap file %r: %s" % (path, e))
+    raw = data.split('\n')
     lines = [ln for ln in raw if ln.strip() != '']
     if not lines:
         raise ValueError("Empty metromap file")
     if len(lines) == 1 and lines[0].strip() == '0':
         return 'UNSAT', []
+    # Uppercase the whole file in one translate call, then validate each
+    # line with one regex match; lines that do not match go through the
+    # token-by-token parser, which reports the error (if any).
+    upper = [ln for ln in data.translate(UPPER_MOVES).split('\n')
+             if ln.strip() != '']
     metros = []
-    for idx, line in enumerate(lines):
-        tokens = line.strip().split()
-        if len(tokens) == 1 and re.fullmatch(r'[LRUDlrud0]+', tokens[0]):
-            s = tokens[0]
-            if s[-1] != '0':
-                raise ValueError(
-                    "Line %d: expected trailing '0' token" % (idx+1))
-            seq = list(s[:-1])
-            metros.append([c.upper() for c in seq])
+    for idx, line in enumerate(upper):
+        m = MOVES_LINE.fullmatch(line.strip())
+        if m is None:
+            metros.append(parse_moves_line(lines[idx], idx))
+        elif m.group(2) is None:
+            metros.append(m.group(1).encode('ascii'))
         else:
-            if not tokens:
-                raise ValueError("Line %d is empty" % (idx+1))
-            if tokens[-1] != '0':
-                raise ValueError(
-                    "Line %d: expected trailing '0' token" % (idx+1))
-            seq = tokens[:-1]
-            parsed = []
-            for t in seq:
-                if len(t) != 1 or t.upper() not in ('L', 'R', 'U', 'D'):
-                    raise ValueError(
-                        "Invalid token %r on line %d" % (t, idx+1))
-                parsed.append(t.upper())
-            metros.append(parsed)
+            metros.append(''.join(m.group(2).split()).encode('ascii'))
     return 'SAT', metros
 
 
-def analyze_constraints(spec, metro_moves):
+# Direction deltas as 256-entry tables indexed by the move's byte value
+# (a metro's moves are stored as bytes, one per move)
+MOVES = b'LRUD'
+DX = [0] * 256
+DY = [0] * 256
+DX[ord('L')], DX[ord('R')] = -1, 1
+DY[ord('U')], DY[ord('D')] = -1, 1
+
+
+def walk_metro(moves, sx, sy, N, M):
+    """Walk one metro's moves from (sx, sy) on an N x M grid.
+
+    Returns (cells, turns, x, y, error): the visited cells flattened to
+    x*M + y, the number of turns, the last position reached and an error
+    message (None if every move was valid and in bounds).
+    """
+    # Fast path: the whole trajectory as running sums of the deltas,
+    # bounds-checked once with min/max
+    if not moves.translate(None, MOVES):
+        xs = list(accumulate(map(DX.__getitem__, moves), initial=sx))
+        ys = list(accumulate(map(DY.__getitem__, moves), initial=sy))
+        if min(xs) >= 0 and max(xs) < N and min(ys) >= 0 and max(ys) < M:
+            cells = list(map(add, map(mul, xs, repeat(M)), ys))
+            turns = sum(map(ne, moves[1:], moves))
+            return cells, turns, xs[-1], ys[-1], None
+    # Slow path: step until the first invalid token / out of bounds
+    x, y = sx, sy
+    cells = [x * M + y]
+    prev = None
+    turns = 0
+    for step_idx, mv in enumerate(moves):
+        if mv not in MOVES:
+            return cells, turns, x, y, "Invalid token %r at step %d" % (chr(mv), step_idx+1)
+        x += DX[mv]
+        y += DY[mv]
+        if not (0 <= x < N and 0 <= y < M):
+            return cells, turns, x, y, "Out of bounds at step %d -> (%d,%d)" % (
+                step_idx+1, x, y)
+        cells.append(x * M + y)
+        if prev is None:
+            prev = mv
+        elif mv != prev:
+            turns += 1
+            prev = mv
+    return cells, turns, x, y, None
+
+
+def analyze_constraints(spec, metro_moves, verbose=True):
+    """Evaluate C1-C4. With verbose=False only what short_summary prints is
+    built: overlapping cells and popular-cell visits carry no owner lists."""
     N = spec.N
     M = spec.M
     K = spec.K
@@ -189,7 +274,6 @@ def analyze_constraints(spec, metro_moves):
         report['final_valid'] = False
         return report
 
-    dirvec = {'L': (-1, 0), 'R': (1, 0), 'U': (0, -1), 'D': (0, 1)}
     per_metro_cells = []
     per_metro_turns = []
     per_metro_errors = []
@@ -197,42 +281,31 @@ def analyze_constraints(spec, metro_moves):
     for k in range(K):
         sx, sy = spec.starts[k]
         ex, ey = spec.ends[k]
-        moves = metro_moves[k]
-        x, y = sx, sy
-        cells = [(x, y)]
-        prev = None
-        turns = 0
-        error = None
-        for step_idx, mv in enumerate(moves):
-            if mv not in dirvec:
-                error = "Invalid token %r at step %d" % (mv, step_idx+1)
-                break
-            dx, dy = dirvec[mv]
-            x += dx
-            y += dy
-            if not (0 <= x < N and 0 <= y < M):
-                error = "Out of bounds at step %d -> (%d,%d)" % (
-                    step_idx+1, x, y)
-                break
-            cells.append((x, y))
-            if prev is None:
-                prev = mv
-            elif mv != prev:
-                turns += 1
-                prev = mv
+        cells, turns, x, y, error = walk_metro(metro_moves[k], sx, sy, N, M)
         if error is None and (x, y) != (ex, ey):
             error = "Final pos %r != end %r" % ((x, y), (ex, ey))
         per_metro_cells.append(cells)
         per_metro_turns.append(turns)
         per_metro_errors.append(error)
 
-    # C1: at-most-one per cell
-    cell_owners = {}
-    for k, cells in enumerate(per_metro_cells):
-        for c in cells:
-            cell_owners.setdefault(c, []).append(k)
-    overlapping = {c: owners for c,
-                   owners in cell_owners.items() if len(owners) > 1}
+    # C1: at-most-one per cell. The map is overlap-free exactly when the
+    # distinct visited cells number as many as the visits, which one set
+    # build answers; only otherwise are visits counted (Counter as a
+    # bincount) and owner lists recovered for the overlapping cells.
+    # There is no K == 1 shortcut: a single metro can still revisit a cell.
+    visited = set(chain.from_iterable(per_metro_cells))
+    overlap_idx = set()
+    if len(visited) != sum(map(len, per_metro_cells)):
+        counts = Counter(chain.from_iterable(per_metro_cells))
+        overlap_idx = {i for i, n in counts.items() if n > 1}
+    overlapping = {}
+    if overlap_idx and not verbose:
+        overlapping = dict.fromkeys(divmod(i, M) for i in overlap_idx)
+    elif overlap_idx:
+        for k, cells in enumerate(per_metro_cells):
+            for i in cells:
+                if i in overlap_idx:
+                    overlapping.setdefault(divmod(i, M), []).append(k)
     if overlapping:
         report['c1'] = {'valid': False, 'details': overlapping}
     else:
@@ -265,9 +338,21 @@ def analyze_constraints(spec, metro_moves):
     if spec.scenario == 2:
         per_popular = []
         missed = []
+        # owners per popular cell are only needed for the verbose report
+        popular_idx = {px * M + py for (px, py) in spec.popular}
+        first_owner = {}
+        if verbose:
+            for k, cells in enumerate(per_metro_cells):
+                for i in popular_idx.intersection(cells):
+                    first_owner.setdefault(i, k)
         for pc in spec.popular:
-            owners = cell_owners.get(pc, [])
-            if owners:
+            i = pc[0] * M + pc[1]
+            if verbose:
+                owners = overlapping.get(pc) or (
+                    [first_owner[i]] if i in first_owner else [])
+            else:
+                owners = []
+            if i in visited:
                 per_popular.append((pc, True, owners))
             else:
                 per_popular.append((pc, False, []))
@@ -400,7 +485,7 @@ def main():
     if state == 'UNSAT':
         print("UNSAT")
         sys.exit(0)
-    report = analyze_constraints(spec, metro_moves)
+    report = analyze_constraints(spec, metro_moves, verbose)
     if verbose:
         verbose_print(report, spec)
     else:
@@ -1,10 +1,9 @@
 #!/usr/bin/env python3
 # decode.py
-# CORRECTED: Uses a robust BFS path reconstruction method to trace the
-# path from the SAT solver's output.
+# Traces each metro line by following its true edges from the SAT
+# solver's output, from start cell to end cell.
 
-import sys, json, os
-from collections import deque
+import sys, json, os, re
 
 if len(sys.argv) != 4:
     sys.exit(2)
@@ -16,131 +15,105 @@ outmap = sys.argv[3]
 # Construct paths based on the base name
 varmapfile = os.path.splitext(base)[0] + ".varmap.json"
 
-# --- Load Metadata ---
-try:
-    with open(varmapfile) as f:
-        meta = json.load(f)
-    lines_spec = meta['lines']
-    K = meta['K']
-    id_to_var = meta['id_to_var']
-except Exception as e:
-    sys.exit(1)
-
 # --- Read SAT Solver Output ---
 try:
-    with open(satout) as f:
-        satlines = [l.strip() for l in f if l.strip()]
+    with open(satout, 'rb') as f:
+        satdata = f.read()
 except Exception as e:
     sys.exit(1)
 
+FIRST_LINE = re.compile(rb'\s*([^\r\n]*)')
+TRUE_LITERAL = re.compile(rb'(?<!\S)[1-9][0-9]*(?!\S)')
+
 # Handle UNSAT case
-if satlines[0].upper() == 'UNSAT':
+first_line = FIRST_LINE.match(satdata)
+if first_line.group(1).strip().upper() == b'UNSAT':
     with open(outmap, 'w') as f:
         f.write("0\n")
     sys.exit(0)
 
+# --- Load Metadata ---
+# Only needed for SAT results, so it is loaded after the UNSAT check
+try:
+    with open(varmapfile, 'rb') as f:
+        meta = json.loads(f.read())
+    lines_spec = meta['lines']
+    K = meta['K']
+    N = meta['N']
+    M = meta['M']
+    # Edge variables come pre-parsed from encode.py as [id, k, x, y, D],
+    # so no variable name has to be split here
+    id_to_edge = {e[0]: tuple(e[1:]) for e in meta['edges']}
+except Exception as e:
+    sys.exit(1)
+
 DIRS = {'R':(1,0), 'L':(-1,0), 'U':(0,-1), 'D':(0,1)}
 
 # --- Parse SAT Solution ---
-# Extract all variables that are assigned to be true
-true_vars_ids = set()
-for line in satlines[1:]: # Skip the 'SAT' line
-    for token in line.split():
-        try:
-            val = int(token)
-            if val > 0:
-                true_vars_ids.add(str(val))
-        except ValueError:
-            pass # Ignore non-integer tokens
-
-# Create a set of true 'E' (edge) variables for efficient lookup
-E_true = set()
-for vid_str in true_vars_ids:
-    if vid_str in id_to_var:
-        name = id_to_var[vid_str]
-        if name.startswith("E_"):
-            _, k, x, y, D = name.split("_")
-            E_true.add((int(k), int(x), int(y), D))
+# Bucket the true 'E' (edge) variables by metro line in a single pass over
+# the positive integer tokens after the 'SAT' line (one regex scan of the
+# raw bytes; ids stay ints throughout).
+# Cells are flattened to x*M + y, so a step is a fixed index offset.
+# Key: k, Value: dict mapping cell -> list of (direction, next cell)
+DIR_OFFSET = {D: dx * M + dy for D, (dx, dy) in DIRS.items()}
+edges_by_line = {}
+for vid in map(int, TRUE_LITERAL.findall(satdata, first_line.end())):
+    edge = id_to_edge.get(vid)
+    if edge:
+        k, x, y, D = edge
+        cell = x * M + y
+        steps = edges_by_line.setdefault(k, {})
+        steps.setdefault(cell, []).append((D, cell + DIR_OFFSET[D]))
 
 # --- Path Reconstruction ---
 
-def perform_bfs_search(adjacency, start, end):
-    """
-    Perform a BFS from start to end on the adjacency list.
-    Returns the path as a list of directions if found, else None.
+def find_path(start, end, steps, max_steps):
     """
-    sx, sy = start
-    ex, ey = end
-
-    queue = deque()
-    visited = set()
-
-    # Initialize the BFS queue with starting position and empty path
-    queue.append((sx, sy, []))
-    visited.add((sx, sy))
-
-    while len(queue) > 0:
-        current_x, current_y, path_so_far = queue.popleft()
-
-        # If target reached, return accumulated directions
-        if (current_x, current_y) == (ex, ey):
-            return path_so_far
-
-        # Explore neighbors of current node
-        neighbors = adjacency.get((current_x, current_y), [])
-        for (next_pos, direction) in neighbors:
-            if next_pos not in visited:
-                visited.add(next_pos)
-                # Construct new path by appending current direction
-                new_path = path_so_far + [direction]
-                queue.append((next_pos[0], next_pos[1], new_path))
+    Follow the true edges of a metro line (its `steps` bucket) from the
+    start cell to the end cell, both given as flat x*M + y indices.
 
-    # No path found if BFS queue exhausted
-    return None
-
-def find_path_bfs(k, sx, sy, ex, ey, E_true, DIRS):
-    """
-    Coordinates building adjacency and BFS pathfinding steps for metro line k.
+    Every cell on a line has at most two true edges, so the path is traced
+    by always taking the edge that does not lead back to the previous cell.
+    Returns the path as a list of directions, or None if the walk dead-ends
+    or exceeds max_steps (malformed solution).
     """
-    adjacency_list = build_adjacency_list_for_line(k, E_true, DIRS)
-    path = perform_bfs_search(adjacency_list, (sx, sy), (ex, ey))
+    path = []
+    cell = start
+    prev = -1
+    while cell != end:
+        if len(path) >= max_steps:
+            return None
+        for (D, nxt) in steps.get(cell, ()):
+            if nxt != prev:
+                break
+        else:
+            return None
+        path.append(D)
+        prev = cell
+        cell = nxt
     return path
 
-def build_adjacency_list_for_line(k, E_true, DIRS):
-    """
-    Build adjacency list for metro line k using edges marked true in SAT solution.
-    """
-    adjacency = {}  # Key: (x,y), Value: list of tuples ((nx, ny), direction)
-    for (kk, x, y, D) in E_true:
-        if kk != k:
-            continue
-        dx, dy = DIRS[D]
-        nx = x + dx
-        ny = y + dy
-        if (x, y) not in adjacency:
-            adjacency[(x, y)] = []
-        adjacency[(x, y)].append(((nx, ny), D))
-    return adjacency
-
 # --- Main Decoding Loop ---
+max_steps = N * M
+
 all_paths_found = True
 output_lines = []
 for k in range(K):
     sx, sy = lines_spec[k][0]
     ex, ey = lines_spec[k][1]
     
-    path = find_path_bfs(k, sx, sy, ex, ey, E_true, DIRS)
+    path = find_path(sx * M + sy, ex * M + ey, edges_by_line.get(k, {}), max_steps)
     
     if path is None:
         all_paths_found = False
         break
     
-    output_lines.append(" ".join(path + ["0"]))
+    output_lines.append(" ".join(path) + " 0")
 
 # --- Write Final Output ---
+# The whole map is assembled with one join and written in one call
 with open(outmap, 'w') as f:
     if all_paths_found:
-        for line in output_lines:
-            f.write(line + "\n")
+        f.write("\n".join(output_lines) + "\n")
     else:
-        f.write("0\n")
\ No newline at end of file
+        f.write("0\n")
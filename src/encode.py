@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 # encode.py
 # FINAL VERSION: Implements an efficient "at-most-J" cardinality
-# constraint using a sequential counter to prevent combinatorial explosion.
+# constraint using a k-bounded totalizer (sequential counter as fallback)
+# to prevent combinatorial explosion.
 
 import sys, json, os
-from itertools import combinations
+from array import array
+from itertools import chain, combinations, product, repeat
 
 if len(sys.argv) != 2:
     sys.exit(2)
@@ -19,10 +21,21 @@ satfile = os.path.join(dir_name, file_name + ".satinput")
 varmapfile = os.path.join(dir_name, file_name + ".varmap.json")
 
 # --- Constants ---
-DIRS = {'R': (1,0), 'L':(-1,0), 'U':(0,-1), 'D':(0,1)}
-DIRS_LIST = ['R','L','U','D']
-REV_DIRS = {'R':'L','L':'R','U':'D','D':'U'}
-STRAIGHT_PAIRS = {('R', 'L'), ('L', 'R'), ('U', 'D'), ('D', 'U')}
+# Directions are ints 0..3 (R, L, U, D) indexing the offset and reverse
+# tables; DIR_NAMES maps them back to letters for names and the varmap
+DIR_NAMES = ('R', 'L', 'U', 'D')
+DIRS_LIST = range(4)
+DX = (1, -1, 0, 0)
+DY = (0, 0, -1, 1)
+REV = (1, 0, 3, 2)
+# IS_STRAIGHT[d1][d2]: entering/leaving a cell through d1 and d2 goes straight
+IS_STRAIGHT = ((False, True, False, False),
+               (True, False, False, False),
+               (False, False, False, True),
+               (False, False, True, False))
+# The 6 unordered direction pairs of a cell as (d1, d2, is_turn), in
+# DIRS_LIST order
+PAIRS = tuple((d1, d2, not IS_STRAIGHT[d1][d2]) for d1, d2 in combinations(DIRS_LIST, 2))
 
 # --- Input Reading ---
 try:
@@ -69,152 +82,246 @@ if P > 0:
         popular.append((px,py))
 
 # --- Variable and Clause Management ---
-var_to_id = {}
-clauses = []
-id_to_var = {}
+clauses = array('i')  # buffered literals, each clause terminated by 0 as in DIMACS
+var_blocks = []  # (prefix, key -> id dict) per named family, in allocation order
 next_var = 1
 
 def add_clause(lits):
-    clauses.append(lits)
+    clauses.extend(lits)
+    clauses.append(0)
 
-def new_var(name):
+def add_clauses(batch):
+    """Buffer a batch of clauses (literal lists) in one C-level extend."""
+    clauses.extend(chain.from_iterable(chain.from_iterable(zip(batch, repeat((0,))))))
+
+def new_var_block(prefix, keys):
+    """
+    Allocate one contiguous range of ids for all `keys` (tuples) at once,
+    instead of one new_var call per variable. Returns the key -> id dict.
+    No names are stored here; var_names builds them for the varmap.
+    """
     global next_var
-    if name in var_to_id: return var_to_id[name]
-    vid = next_var
-    next_var += 1
-    var_to_id[name] = vid
-    id_to_var[str(vid)] = name
-    return vid
+    ids = range(next_var, next_var + len(keys))
+    next_var += len(keys)
+    block = dict(zip(keys, ids))
+    var_blocks.append((prefix, block))
+    return block
+
+def var_names():
+    """
+    Name -> id for every variable allocated by new_var_block, named
+    "<prefix>_<key parts>", e.g. ("L", (0, 1, 2)) -> "L_0_1_2". Edge
+    directions are written as letters, e.g. (0, 1, 2, 0) -> "E_0_1_2_R".
+    """
+    names = {}
+    for prefix, block in var_blocks:
+        if prefix == "E":
+            names.update((f"E_{k}_{x}_{y}_{DIR_NAMES[d]}", vid)
+                         for (k, x, y, d), vid in block.items())
+        else:
+            names.update((f"{prefix}_{k}_{x}_{y}", vid)
+                         for (k, x, y), vid in block.items())
+    return names
+
+# Above this many variables at_most_one switches from pairwise to the
+# binary encoding (n*log2(n) clauses instead of n*(n-1)/2)
+AMO_PAIRWISE_MAX = 7
 
 def at_most_one(var_list):
-    for i in range(len(var_list)):
-        for j in range(i + 1, len(var_list)):
-            add_clause([-var_list[i], -var_list[j]])
+    """
+    At-most-one clauses over var_list, returned as a list. Small lists use
+    the pairwise encoding; larger ones the binary (bitwise) encoding, which
+    gives variable i the bit pattern of i over ceil(log2 n) auxiliary
+    variables, so no two variables can be true together.
+    """
+    n = len(var_list)
+    if n <= AMO_PAIRWISE_MAX:
+        return [[-a, -b] for a, b in combinations(var_list, 2)]
+    width = (n - 1).bit_length()
+    first = reserve_vars(width)
+    return [[-v, first + j if i >> j & 1 else -(first + j)]
+            for i, v in enumerate(var_list) for j in range(width)]
 
 def exactly_k_if_L(l_var, e_vars, k):
+    """
+    Clauses for "l_var implies exactly k of e_vars", yielded lazily so
+    add_clauses consumes them without an intermediate list.
+    """
     n = len(e_vars)
     if n > k:
-        for subset in combinations(e_vars, k + 1):
-            add_clause([-l_var] + [-v for v in subset])
+        yield from ([-l_var] + [-v for v in subset] for subset in combinations(e_vars, k + 1))
     if k > 0:
-        for subset in combinations(e_vars, n - k + 1):
-            add_clause([-l_var] + list(subset))
+        # With fewer than k edges this is the single clause [-l_var]
+        yield from ([-l_var, *subset] for subset in combinations(e_vars, max(n - k + 1, 0)))
 
 # --- OPTIMIZATION START: Efficient At-Most-K Constraint ---
-def add_at_most_k_constraint(variables, k, prefix="s"):
-    num_vars = len(variables)
-    if num_vars <= k:
-        # If the number of variables is already small enough, 
-        # the constraint is trivially satisfied.
-        return
-
-    # Initialize a matrix of auxiliary Boolean variables
-    sequential_matrix = []
-    for i in range(num_vars):
-        row_vars = []
-        for j in range(k + 1):
-            var_name = f"{prefix}_{i}_{j}"
-            row_vars.append(new_var(var_name))
-        sequential_matrix.append(row_vars)
+# Cardinality encoding for the turn limit: "totalizer" or "seqcounter"
+TURN_ENCODING = "totalizer"
 
-    # --- Base Case Setup ---
-    _initialize_base_constraints(variables, sequential_matrix, k)
-
-    # --- Recursive / Inductive Step ---
-    for i in range(1, num_vars):
-        _propagate_constraints(i, variables, sequential_matrix, k)
-
-    # --- Final Restriction ---
-    # Prevent the total sum from exceeding k
-    add_clause([-sequential_matrix[num_vars - 1][k]])
+def reserve_vars(count):
+    """Allocate a block of `count` unnamed auxiliary variables; returns the first id."""
+    global next_var
+    first = next_var
+    next_var += count
+    return first
 
-def _propagate_constraints(i, variables, seq_matrix, k):
-    """Handles propagation of constraints for variable index `i`."""
-    for j in range(k + 1):
-        # If we reached >= j earlier, we continue to satisfy it
-        add_clause([-seq_matrix[i - 1][j], seq_matrix[i][j]])
+def add_at_most_k_constraint(variables, k, encoding=TURN_ENCODING):
+    """
+    At most k of `variables` may be true.
+
+    encoding="seqcounter": Sinz sequential counter. Register variable
+    s(i, j) means "at least j+1 of variables[0..i] are true" (i < n-1,
+    j < k); the (n-1)*k registers are one contiguous block of unnamed
+    auxiliary variables.
+    encoding="totalizer": k-bounded totalizer, see _totalizer_outputs; it
+    falls back to the sequential counter when k is close to n/2, where
+    its merge clauses stop paying off.
+    """
+    n = len(variables)
+    if n <= k:
+        # If the number of variables is already small enough,
+        # the constraint is trivially satisfied.
+        return
+    if k == 0:
+        for v in variables:
+            add_clause([-v])
+        return
+    if encoding == "totalizer" and 2 * k < n:
+        add_clause([-_totalizer_outputs(variables, k)[k]])
+        return
 
-    # Enforce increment logic
-    add_clause([-variables[i], seq_matrix[i][0]])
+    base = reserve_vars((n - 1) * k)
+
+    # --- Base Case: the first variable sets at most the first register ---
+    add_clause([-variables[0], base])
+    for j in range(1, k):
+        add_clause([-(base + j)])
+
+    # --- Inductive Step: carry counts forward, increment on a true var ---
+    for i in range(1, n - 1):
+        x = variables[i]
+        row, prev = base + i * k, base + (i - 1) * k
+        add_clause([-x, row])
+        add_clause([-prev, row])
+        for j in range(1, k):
+            add_clause([-x, -(prev + j - 1), row + j])
+            add_clause([-(prev + j), row + j])
+        # A true variable must not push the count past k
+        add_clause([-x, -(prev + k - 1)])
+
+    # --- Final Restriction: the last variable cannot exceed k either ---
+    add_clause([-variables[n - 1], -(base + (n - 2) * k + k - 1)])
+
+def _totalizer_outputs(variables, k):
+    """
+    Build a k-bounded totalizer over `variables` and return its unary count
+    outputs: out[j] is forced true once at least j+1 inputs are true
+    (at most k+1 outputs per node, so the tree has O(n*k) clauses).
+    """
+    if len(variables) == 1:
+        return variables
+    mid = len(variables) // 2
+    left = _totalizer_outputs(variables[:mid], k)
+    right = _totalizer_outputs(variables[mid:], k)
+    size = min(len(left) + len(right), k + 1)
+    first = reserve_vars(size)
+    # left/right count a and b (0 = no literal needed) imply out count a+b
+    for a in range(len(left) + 1):
+        for b in range(max(1 - a, 0), min(len(right), size - a) + 1):
+            clause = [first + a + b - 1]
+            if a:
+                clause.append(-left[a - 1])
+            if b:
+                clause.append(-right[b - 1])
+            add_clause(clause)
+    return list(range(first, first + size))
 
-    for j in range(1, k + 1):
-        # Classic sequential counter propagation
-        add_clause([-variables[i], -seq_matrix[i - 1][j - 1], seq_matrix[i][j]])
+# --- OPTIMIZATION END ---
 
-def _initialize_base_constraints(variables, seq_matrix, k):
-    """Handles constraint setup for the first variable row."""
-    first_var = variables[0]
 
-    # If first variable is True, that contributes to the sum
-    add_clause([-first_var, seq_matrix[0][0]])
+# --- Variable Definitions ---
+# Each family gets one contiguous block of ids, allocated in bulk.
+cells = list(product(range(N), range(M)))
+endpoints = {cell for spec in lines_spec for cell in spec}
 
-    # For all higher sums, it’s impossible to exceed one variable’s value
-    for j in range(1, k + 1):
-        add_clause([-seq_matrix[0][j]])
+def line_cells(start, end):
+    """
+    Cells line (start, end) can possibly use, in grid order; the others get
+    no L/T/S/E variables. Other lines' endpoints are always taken by those
+    lines, and with J <= 1 the path is the straight segment (J == 0) or one
+    of the two L-shaped routes (J == 1) between its endpoints.
+    """
+    usable = [c for c in cells if c not in endpoints or c == start or c == end]
+    if J >= 2:
+        return usable
+    (sx, sy), (ex, ey) = start, end
+    xs = range(min(sx, ex), max(sx, ex) + 1)
+    ys = range(min(sy, ey), max(sy, ey) + 1)
+    if J == 0 and sx != ex and sy != ey:
+        allowed = {start, end}
+    else:
+        allowed = {(x, sy) for x in xs} | {(ex, y) for y in ys}
+        if J == 1:
+            allowed |= {(sx, y) for y in ys} | {(x, ey) for x in xs}
+    return [c for c in usable if c in allowed]
+
+L_vars = new_var_block("L", [(k, x, y) for k, (start, end) in enumerate(lines_spec)
+                             for (x, y) in line_cells(start, end)])
+# A path can turn at most once per cell other than its start and end, so
+# with J >= N*M - 2 the turn limit never binds: no T variables (and hence no
+# turn clauses or counters) are needed at all
+turns_limited = J < N * M - 2
+T_vars = new_var_block("T", [(k, x, y) for (k, x, y) in L_vars if turns_limited
+                             and (x, y) != lines_spec[k][0] and (x, y) != lines_spec[k][1]])
+S_vars = new_var_block("S", list(L_vars))
+# Edges only between two cells the line can use
+E_vars = new_var_block("E", [(k, x, y, d) for (k, x, y) in L_vars for d in DIRS_LIST
+                             if (k, x + DX[d], y + DY[d]) in L_vars])
 
-# --- OPTIMIZATION END ---
+cells_lines = {}
+for (k, x, y), vid in L_vars.items():
+    cells_lines.setdefault((x, y), []).append(vid)
 
+# Flat per-line list of the existing edges as (x, y, nx, ny, e_var), so
+# edge passes need no N*M*4 probing of E_vars
+edges_by_line = {}
+for (k, x, y, d), evid in E_vars.items():
+    edges_by_line.setdefault(k, []).append((x, y, x + DX[d], y + DY[d], evid))
 
-# --- Variable Definitions ---
-L_vars, E_vars, T_vars, S_vars = {}, {}, {}, {}
-cells_lines = {}
+# (k, x, y) -> [(d, e_var)] of the cell's existing edges in DIRS_LIST order,
+# shared by the per-cell passes instead of each probing E_vars 4 times
+incident = {}
+for (k, x, y, d), evid in E_vars.items():
+    incident.setdefault((k, x, y), []).append((d, evid))
 
-for k, (start, end) in enumerate(lines_spec):
-    for x in range(N):
-        for y in range(M):
-            lname = f"L_{k}_{x}_{y}"
-            L_vars[(k,x,y)] = new_var(lname)
-            cells_lines.setdefault((x,y), []).append(L_vars[(k,x,y)])
-            
-            if (x,y) != start and (x,y) != end:
-                tname = f"T_{k}_{x}_{y}"
-                T_vars[(k,x,y)] = new_var(tname)
-            
-            sname = f"S_{k}_{x}_{y}"
-            S_vars[(k,x,y)] = new_var(sname)
-            
-            for D in DIRS_LIST:
-                dx, dy = DIRS[D]
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < N and 0 <= ny < M:
-                    ename = f"E_{k}_{x}_{y}_{D}"
-                    E_vars[(k,x,y,D)] = new_var(ename)
+T_by_line = {}  # k -> [(x, y, t_var)], so each line's turn cells are not filtered out of T_vars
+for (k, x, y), vid in T_vars.items():
+    T_by_line.setdefault(k, []).append((x, y, vid))
 
 # --- CONSTRAINTS ---
 
-def enforce_turn_constraints(lines_spec, T_vars, L_vars, E_vars, DIRS_LIST, STRAIGHT_PAIRS, J):
+def enforce_turn_constraints(lines_spec, T_by_line, L_vars, incident, PAIRS, J):
     """
     Restrict and count turns in paths using efficient counters.
     """
     for k, (start, end) in enumerate(lines_spec):
         turn_vars_for_line = []
 
-        for (line_k, x, y), t_var in T_vars.items():
-            if line_k != k:
-                continue
-
+        for (x, y, t_var) in T_by_line.get(k, []):
             turn_vars_for_line.append(t_var)
             l_var = L_vars[(k, x, y)]
 
             add_clause([-t_var, l_var])
 
-            for d1_index, D1 in enumerate(DIRS_LIST[:-1]):
-                for d2_index in range(d1_index + 1, len(DIRS_LIST)):
-                    D2 = DIRS_LIST[d2_index]
-
-                    e1 = E_vars.get((k, x, y, D1))
-                    e2 = E_vars.get((k, x, y, D2))
-
-                    if e1 and e2:
-                        is_straight_move = (D1, D2) in STRAIGHT_PAIRS
-
-                        if not is_straight_move:
-                            add_clause([-l_var, -e1, -e2, t_var])
-                        else:
-                            add_clause([-l_var, -e1, -e2, -t_var])
+            # A pair of used edges at a cell either turns (forces T) or
+            # goes straight (forbids T); all pairs of the cell in one batch
+            present = dict(incident.get((k, x, y), ()))
+            add_clauses(
+                [-l_var, -present[d1], -present[d2], t_var if is_turn else -t_var]
+                for (d1, d2, is_turn) in PAIRS if d1 in present and d2 in present)
 
         if turn_vars_for_line:
-            add_at_most_k_constraint(turn_vars_for_line, J, prefix=f"s_k{k}")
+            add_at_most_k_constraint(turn_vars_for_line, J)
 
 def enforce_unique_occupancy(cells_lines):
     """
@@ -222,32 +329,30 @@ def enforce_unique_occupancy(cells_lines):
     """
     for (x, y), vids in cells_lines.items():
         if len(vids) > 1:
-            at_most_one(vids)
+            add_clauses(at_most_one(vids))
 
-def enforce_path_continuity(lines_spec, L_vars, E_vars, N, M, DIRS_LIST):
+def enforce_path_continuity(k, start, end, L_vars, incident, N, M):
     """
-    Enforce continuity constraints on paths to ensure proper connectivity
-    between start and end points and along each path cell.
+    Enforce continuity constraints on line k's path to ensure proper
+    connectivity between start and end points and along each path cell.
     """
-    for k, (start, end) in enumerate(lines_spec):
-        # Starts and ends must be used
-        add_clause([L_vars[(k, start[0], start[1])]])
-        add_clause([L_vars[(k, end[0], end[1])]])
+    # Starts and ends must be used
+    add_clause([L_vars[(k, start[0], start[1])]])
+    add_clause([L_vars[(k, end[0], end[1])]])
 
-        for x in range(N):
-            for y in range(M):
-                lvid = L_vars.get((k, x, y))
-                if not lvid:
-                    continue
+    for x in range(N):
+        for y in range(M):
+            lvid = L_vars.get((k, x, y))
+            if not lvid:
+                continue
 
-                incident_edges = [E_vars[(k, x, y, d)] for d in DIRS_LIST if (k, x, y, d) in E_vars]
+            incident_edges = [evid for d, evid in incident.get((k, x, y), ())]
 
-                if (x, y) == start or (x, y) == end:
-                    exactly_k_if_L(lvid, incident_edges, 1)
-                else:
-                    exactly_k_if_L(lvid, incident_edges, 2)
-                    for evid in incident_edges:
-                        add_clause([lvid, -evid])
+            if (x, y) == start or (x, y) == end:
+                add_clauses(exactly_k_if_L(lvid, incident_edges, 1))
+            else:
+                add_clauses(exactly_k_if_L(lvid, incident_edges, 2))
+                add_clauses([lvid, -evid] for evid in incident_edges)
 
 def enforce_popular_cell_constraint(mode, popular, cells_lines):
     """
@@ -265,94 +370,114 @@ def enforce_popular_cell_constraint(mode, popular, cells_lines):
             add_clause([1])
             add_clause([-1])
 
-def enforce_edge_location_consistency(E_vars, L_vars, DIRS, REV_DIRS):
+def enforce_edge_location_consistency(E_vars, L_vars, DX, DY, REV):
     """
     Ensure edges are consistent with presence of endpoints and neighbors.
 
     If an edge exists, both endpoints must be active.
     Edges must have reciprocal counterparts where applicable.
     """
-    for (k, x, y, D), evid in E_vars.items():
-        loc_var = L_vars[(k, x, y)]
-
-        dx, dy = DIRS[D]
-        nx, ny = x + dx, y + dy
-
-        add_clause([-evid, loc_var])
-        add_clause([-evid, L_vars[(k, nx, ny)]])
-
-        revD = REV_DIRS[D]
-        rev_evid = E_vars.get((k, nx, ny, revD))
+    for (k, x, y, d), evid in E_vars.items():
+        nx, ny = x + DX[d], y + DY[d]
+        rev_evid = E_vars.get((k, nx, ny, REV[d]))
 
-        if rev_evid:
-            add_clause([-evid, rev_evid])
-            add_clause([-rev_evid, evid])
-        else:
+        if not rev_evid:
+            # An edge without a reciprocal counterpart can never be used
             add_clause([-evid])
-
-def enforce_path_connectivity(lines_spec, S_vars, E_vars, L_vars, N, M, DIRS, DIRS_LIST):
+        elif d == 0 or d == 3:
+            # Each edge pair is handled once, from its R/D (canonical) side:
+            # both directions need both endpoints, and are used together
+            l_var, nl_var = L_vars[(k, x, y)], L_vars[(k, nx, ny)]
+            add_clauses(([-evid, l_var], [-evid, nl_var],
+                         [-rev_evid, l_var], [-rev_evid, nl_var],
+                         [-evid, rev_evid], [-rev_evid, evid]))
+
+def enforce_path_connectivity(k, start, S_vars, edges_by_line, L_vars, N, M):
     """
-    Ensure starting cells are reachable and paths propagate connectivity properly.
+    Ensure line k's starting cell is reachable and its path propagates
+    connectivity properly.
     """
-    for k, (start, end) in enumerate(lines_spec):
-        sx, sy = start
-        add_clause([S_vars[(k, sx, sy)]])
+    sx, sy = start
+    add_clause([S_vars[(k, sx, sy)]])
 
-        for x in range(N):
-            for y in range(M):
-                for D in DIRS_LIST:
-                    e_var = E_vars.get((k, x, y, D))
-                    if e_var:
-                        dx, dy = DIRS[D]
-                        nx, ny = x + dx, y + dy
+    # Reachability flows along every used edge; every used cell is reachable
+    add_clauses([-S_vars[(k, x, y)], -e_var, S_vars[(k, nx, ny)]]
+                for (x, y, nx, ny, e_var) in edges_by_line.get(k, []))
+    add_clauses([-L_vars[(k, x, y)], S_vars[(k, x, y)]]
+                for x in range(N) for y in range(M) if (k, x, y) in L_vars)
 
-                        add_clause([-S_vars[(k, x, y)], -e_var, S_vars[(k, nx, ny)]])
+# Main execution flow calling all steps in order
 
-        for x in range(N):
-            for y in range(M):
-                l_var = L_vars[(k, x, y)]
-                s_var = S_vars[(k, x, y)]
-                add_clause([-l_var, s_var])
+def format_clauses(buf):
+    # One %-format call renders every literal as "<lit> "; 0 only ever
+    # appears as a terminator, so each " 0 " ends a clause
+    return ("%d " * len(buf) % tuple(buf)).replace(" 0 ", " 0\n")
 
-# Main execution flow calling all steps in order
+def flush_clauses(out):
+    """
+    Write the clauses buffered by the last pass to `out` and empty the
+    buffer, so the full clause list is never held in memory at once.
+    """
+    global num_clauses
+    num_clauses += clauses.count(0)
+    out.write(format_clauses(clauses))
+    del clauses[:]
 
-def apply_all_constraints(mode, cells_lines, E_vars, L_vars, T_vars, S_vars, lines_spec,
-                          DIRS, REV_DIRS, DIRS_LIST, STRAIGHT_PAIRS, J, popular, N, M):
+def apply_all_constraints(out, mode, cells_lines, E_vars, edges_by_line, L_vars, T_by_line, S_vars, lines_spec,
+                          DX, DY, REV, incident, PAIRS, J, popular, N, M):
 
     enforce_unique_occupancy(cells_lines)
-    enforce_edge_location_consistency(E_vars, L_vars, DIRS, REV_DIRS)
-    enforce_path_continuity(lines_spec, L_vars, E_vars, N, M, DIRS_LIST)
-    enforce_turn_constraints(lines_spec, T_vars, L_vars, E_vars, DIRS_LIST, STRAIGHT_PAIRS, J)
-    enforce_path_connectivity(lines_spec, S_vars, E_vars, L_vars, N, M, DIRS, DIRS_LIST)
-    enforce_popular_cell_constraint(mode, popular, cells_lines)
+    flush_clauses(out)
+    enforce_edge_location_consistency(E_vars, L_vars, DX, DY, REV)
+    flush_clauses(out)
+    enforce_turn_constraints(lines_spec, T_by_line, L_vars, incident, PAIRS, J)
+    flush_clauses(out)
 
-apply_all_constraints(
-    mode=mode,
-    cells_lines=cells_lines,
-    E_vars=E_vars,
-    L_vars=L_vars,
-    T_vars=T_vars,
-    S_vars=S_vars,
-    lines_spec=lines_spec,
-    DIRS=DIRS,
-    REV_DIRS=REV_DIRS,
-    DIRS_LIST=DIRS_LIST,
-    STRAIGHT_PAIRS=STRAIGHT_PAIRS,
-    J=J,
-    popular=popular,
-    N=N,
-    M=M
-)
+    # Continuity and connectivity go line by line, flushed after each line
+    for k, (start, end) in enumerate(lines_spec):
+        enforce_path_continuity(k, start, end, L_vars, incident, N, M)
+        enforce_path_connectivity(k, start, S_vars, edges_by_line, L_vars, N, M)
+        flush_clauses(out)
 
+    enforce_popular_cell_constraint(mode, popular, cells_lines)
+    flush_clauses(out)
 
 # --- Output Generation ---
-num_vars = next_var - 1
-num_clauses = len(clauses)
-with open(satfile,'w') as f:
-    f.write(f"p cnf {num_vars} {num_clauses}\n")
-    for c in clauses:
-        f.write(" ".join(str(l) for l in c) + " 0\n")
-
-metadata = {'var_to_id': var_to_id, 'id_to_var': id_to_var, 'N':N,'M':M,'K':K,'J':J, 'mode':mode,'lines':lines_spec,'popular':popular}
+# Clauses are streamed to satfile pass by pass. The header goes first as a
+# padded placeholder and is overwritten once the final counts are known.
+HEADER_WIDTH = 40
+num_clauses = 0
+with open(satfile, 'w') as f:
+    f.write("p cnf".ljust(HEADER_WIDTH) + "\n")
+    apply_all_constraints(
+        out=f,
+        mode=mode,
+        cells_lines=cells_lines,
+        E_vars=E_vars,
+        edges_by_line=edges_by_line,
+        L_vars=L_vars,
+        T_by_line=T_by_line,
+        S_vars=S_vars,
+        lines_spec=lines_spec,
+        DX=DX,
+        DY=DY,
+        REV=REV,
+        incident=incident,
+        PAIRS=PAIRS,
+        J=J,
+        popular=popular,
+        N=N,
+        M=M
+    )
+    num_vars = next_var - 1
+    f.seek(0)
+    f.write(f"p cnf {num_vars} {num_clauses}".ljust(HEADER_WIDTH))
+
+# Variable names are only built here, for the varmap; edge variables are
+# also stored pre-parsed so decode.py never splits names
+var_to_id = var_names()
+id_to_var = {str(vid): name for name, vid in var_to_id.items()}
+edges = [[vid, k, x, y, DIR_NAMES[d]] for (k, x, y, d), vid in E_vars.items()]
+metadata = {'var_to_id': var_to_id, 'id_to_var': id_to_var, 'edges': edges, 'N':N,'M':M,'K':K,'J':J, 'mode':mode,'lines':lines_spec,'popular':popular}
 with open(varmapfile,'w') as f:
     json.dump(metadata, f, indent=2)
\ No newline at end of file